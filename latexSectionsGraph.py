@@ -1,7 +1,32 @@
 from pylatexenc.latexwalker import LatexWalker, LatexEnvironmentNode, LatexMacroNode
 import networkx as nx
 from pathlib import Path
-import matplotlib.pyplot as plt
+import re
+import sys
+
+# Macros referring to a label, each one creating an edge towards the section the label belongs to.
+_REF_MACROS = frozenset({'Cref', 'cref', 'ref', 'eqref', 'autoref', 'nameref'})
+# Environments whose labels are attributed to the section containing them.
+_ENV_EQUATION = frozenset({'equation', 'align'})
+
+# Patterns used to scan the raw LaTeX source when the fast path is enabled.
+# Sectioning macros may be starred and take a short title, as in \section*{Title} or \section[Short]{Title}.
+_SOURCE_SECTION_MACROS = r'(section|subsection|subsubsection)\s*\*?\s*(?:\[[^\]]*\]\s*)?'
+_SOURCE_LABEL_MACROS = r'(label|Cref|cref|ref|eqref|autoref|nameref)\s*'
+# A macro starts at a backslash preceded by an even number of backslashes, such that x\\ref{a} is a line break followed
+# by the text ref{a}.
+_SOURCE_MACROS = r'(?<!\\)(?:\\\\)*\\(?:' + _SOURCE_SECTION_MACROS + r'|' + _SOURCE_LABEL_MACROS + r')\{'
+_SOURCE_PATTERN = re.compile(_SOURCE_MACROS + r'([^{}]*)\}')
+# Arguments with nested braces cannot be captured by _SOURCE_PATTERN.
+_NESTED_BRACES_PATTERN = re.compile(_SOURCE_MACROS + r'[^{}]*\{')
+# Verbatim text, code listings, and comment environments may contain macros that LaTeX never interprets, which the scan
+# cannot tell apart.
+_VERBATIM_ENVIRONMENTS = r'verbatim|Verbatim|BVerbatim|lstlisting|minted|comment'
+_VERBATIM_MACROS = r'verb|lstinline|mintinline'
+_VERBATIM_PATTERN = re.compile(r'\\begin\s*\{(?:' + _VERBATIM_ENVIRONMENTS + r')\*?\}|\\(?:' + _VERBATIM_MACROS + r')(?![a-zA-Z])')
+# A comment starts at a % preceded by an even number of backslashes, such that \% is kept but \\% is a line break
+# followed by a comment. The backslashes are kept in the first group.
+_COMMENT_PATTERN = re.compile(r'(?<!\\)((?:\\\\)*)%.*')
 
 class LatexSectionsGraph:
     '''
@@ -18,42 +43,51 @@ class LatexSectionsGraph:
         when referring to a subsection, the edge will point to the section it belongs to.
     node_threshold: The minimum number of edges a node must have to be kept in the graph. Nodes with less than this number
         of edges will be removed from the graph.
+    fast: If True, then the sections, labels, and references are found by scanning the LaTeX source with a regular expression
+        instead of parsing it with LatexWalker, which is much faster on large files. The parser only considers the elements
+        at the top level of the document body, plus the labels of equation and align environments. The scan considers every
+        label and reference of the document body, including the ones nested in other environments, in groups or macro
+        arguments (e.g. \\textbf{\\ref{sec:a}}), and the references inside equation and align environments. Section titles and
+        label names are also taken as written in the source, whereas the parser keeps the text before the first macro, math,
+        or special character. For instance, \\section{Foo \\& Bar} gives the node 'Foo \\& Bar' with the scan but 'Foo ' with
+        the parser, and \\section{Foo~Bar} gives 'Foo~Bar' but 'Foo'. If a section, label, or reference argument contains
+        nested braces, or if the file contains verbatim text, code listings, or comment environments, the parser is used anyway.
     '''
-    def __init__(self, file_path, use_subsubsection=False, use_subsection=True, node_threshold=2):
-        self.verify_tex_path(file_path)
-        self.file_path = file_path
+    def __init__(self, file_path, use_subsubsection=False, use_subsection=True, node_threshold=2, fast=False):
+        self.file_path = self.verify_tex_path(file_path)
         self.parse_tex_file()
-        # Instantiate a directed graph.
-        self.graph = nx.DiGraph()
-        # Add nodes and edges to the graph without using subsubsections.
-        label_section_map = self.add_nodes(use_subsubsection, use_subsection)
-        self.add_edges(label_section_map, use_subsubsection, use_subsection)
+        # Find the edges in a single traversal of the document and instantiate a directed graph from them.
+        self.graph = nx.DiGraph(self._collect_edges(use_subsubsection, use_subsection, fast))
+        # Node positions computed by the NetworkX layouts, keyed by layout name, along with the state of the graph
+        # they were computed for.
+        self._layout_cache = {}
         # Remove nodes that have less than 2 edges.
         self.remove_lightly_connected_nodes(node_threshold)
 
     def verify_tex_path(self, file_path):
         '''
-        Verify that the file path exists and is a .tex file.
+        Verify that the file path exists and is a .tex file, and return it as a Path.
         '''
-        if not Path(file_path).exists():
+        path = Path(file_path)
+        if not path.exists():
             raise FileNotFoundError(f'File {file_path} not found.')
-        if not Path(file_path).suffix == '.tex':
+        if not path.suffix == '.tex':
             raise ValueError(f'File {file_path} is not a .tex file.')
+        return path
 
     def parse_tex_file(self):
         '''
         Parse the LaTeX file using LatexWalker.
         '''
-        self.file_content = self.read_file_content(Path(self.file_path))
+        self.file_content = self.read_file_content(self.file_path)
         self.soup = LatexWalker(self.file_content)
 
     def read_file_content(self, file_path:Path):
         '''
-        If the Path provided resolves to an existing LaTeX file, read its content and return it as a string.
+        Read the content of the LaTeX file, assumed to be encoded in UTF-8, and return it as a string.
+        The file is expected to have been checked by verify_tex_path beforehand.
         '''
-        if file_path.exists():
-            with open(file_path.absolute().as_posix()) as f:
-                return f.read()
+        return file_path.read_text(encoding='utf-8')
 
     def visualize_graph(self):
         '''
@@ -61,11 +95,13 @@ class LatexSectionsGraph:
         The size of each node is proportional to the number of edges it has, and  the edges are blue while the nodes are red.
         The labels are displayed in white.
         '''
+        # Imported here such that using the graph without visualizing it does not require loading Matplotlib.
+        import matplotlib.pyplot as plt
         #pos = nx.spring_layout(self.graph, k=10, iterations=1500)
-        pos = nx.shell_layout(self.graph)
+        pos = self._layout('shell')
         #pos = nx.circular_layout(self.graph, scale=10)
         #pos = nx.kamada_kawai_layout(self.graph, scale=3)
-        nodesize = [500*len(self.graph.in_edges(node)) for node in self.graph.nodes()]
+        nodesize = [500*degree for node, degree in self.graph.in_degree()]
         nx.draw_networkx_edges(self.graph, pos, alpha=1, width=3, edge_color="b", arrowsize=20, arrowstyle="->")
         nx.draw_networkx_nodes(self.graph, pos, node_size=nodesize, node_color="#ff0000", alpha=0.5)
         label_options = {"ec": "k", "fc": "white", "alpha": 0.7}
@@ -79,114 +115,186 @@ class LatexSectionsGraph:
         remove = [node for node, degree in self.graph.degree() if degree < threshold]
         self.graph.remove_nodes_from(remove)
 
-    def add_nodes(self, use_subsubsection=False, use_subsection=True):
+    def _layout(self, name):
+        '''
+        Return the node positions computed by the NetworkX layout with the given name (e.g. 'shell' for nx.shell_layout).
+        The positions are computed once and reused as long as the nodes and the number of edges of the graph are unchanged,
+        since self.graph can be modified directly.
         '''
-        Traverse the LatexWalker tree and find all section, subsection, subsubsection, label, and reference elements.
-        When a label is found, the preceding section, subsection, or subsubsection is added as a node in the graph.
+        state = (tuple(self.graph), self.graph.number_of_edges())
+        cached = self._layout_cache.get(name)
+        if cached is None or cached[0] != state:
+            cached = (state, getattr(nx, f'{name}_layout')(self.graph))
+            self._layout_cache[name] = cached
+        return cached[1]
 
-        If use_subsubsection is True, then the graph will contain edges between subsubsections. Otherwise,
-        when referring to a subsubsection, the edge will point to the subsection it belongs to.
+    def _collect_edges(self, use_subsubsection=False, use_subsection=True, fast=False):
         '''
-        s = self.soup
-        (nodelist, pos, len_) = s.get_latex_nodes(pos=0)
+        Find the labels and references of the document, either by scanning its source if fast is True or by traversing
+        the LatexWalker tree otherwise. References are resolved once the whole document has been scanned, such that
+        forward references are also taken into account.
+
+        Return the list of edges of the graph, each one going from the referenced section to the referring section.
+        '''
+        content = self.file_content
+        if fast and not _NESTED_BRACES_PATTERN.search(content) and not _VERBATIM_PATTERN.search(content):
+            label_section_map, pending_refs = self._scan_source(use_subsubsection, use_subsection)
+        else:
+            label_section_map, pending_refs = self._scan_latex_nodes(use_subsubsection, use_subsection)
+
+        # Resolve the references now that all labels are known. A section referenced several times from the same
+        # section only yields one edge, so duplicates are dropped. A dict is used rather than a set to keep the
+        # order in which edges are found, which determines the node order in the graph and thus in the layouts.
+        edges = {}
+        for label_name, section in pending_refs:
+            target = label_section_map.get(label_name)
+            if target is not None and target != section:
+                edges[(target, section)] = None
+        return list(edges)
+
+    def _scan_source(self, use_subsubsection=False, use_subsection=True):
+        '''
+        Scan the LaTeX source with a regular expression and find all section, subsection, subsubsection, label, and
+        reference macros in the order they appear in the document. When a label is found, it is mapped to the preceding
+        section, subsection, or subsubsection. When a reference is found, it is recorded along with the section it appears in.
+
+        Return the map from label names to sections and the list of (label name, section) pairs of the references.
+        '''
+        label_section_map = {}
+        pending_refs = []
+
+        # Locate the document environment with plain substring searches, which are much faster than a regular expression
+        # that has to try to match at every position of the source.
+        content = _COMMENT_PATTERN.sub(r'\1', self.file_content)
+        begin = content.find(r'\begin{document}')
+        end = content.find(r'\end{document}', begin)
+        if begin < 0 or end < 0:
+            return label_section_map, pending_refs
+        document = content[begin + len(r'\begin{document}'):end]
 
-        # Keep track of the previous section, subsection, and subsubsection
-        # such that the label can refer to the immediately preceding section.
         prev_section        = None
         prev_subsection     = None
         prev_subsubsection  = None
 
-        # Maps label names to the section, subsection, or subsubsection they refer to.
-        # That ways, a reference can be resolved to the section, subsection, or subsubsection it refers to.
-        label_section_map = {}
+        # Section and label names are interned, such that comparing them or looking them up in label_section_map
+        # is mostly a pointer comparison.
+        intern = sys.intern
+        for section_macroname, macroname, argument in _SOURCE_PATTERN.findall(document):
+            macroname = section_macroname or macroname
+            argument = intern(argument)
+            if macroname == 'section':
+                prev_section = argument
+                prev_subsection    = None
+                prev_subsubsection = None
+            elif macroname == 'subsection':
+                prev_subsection    = argument
+                prev_subsubsection = None
+            elif macroname == 'subsubsection':
+                prev_subsubsection = argument
+            else:
+                if prev_subsubsection and use_subsubsection:
+                    section = prev_subsubsection
+                elif prev_subsection and use_subsection:
+                    section = prev_subsection
+                elif prev_section:
+                    section = prev_section
+                else:
+                    continue
+                if macroname == 'label':
+                    label_section_map[argument] = section
+                else:
+                    pending_refs.append((argument, section))
+        return label_section_map, pending_refs
 
-        # Traverse the tree in a depth-first manner.
-        for node in nodelist:
-            if node.isNodeType(LatexEnvironmentNode):
-                if node.environmentname == 'document':
-                    nodelist = node.nodelist
-                    for node in nodelist:
-                        if node.isNodeType(LatexEnvironmentNode):
-                            if node.environmentname == 'equation' or node.environmentname == 'align':
-                                for sub_node in node.nodelist:
-                                    if sub_node.isNodeType(LatexMacroNode):
-                                        if sub_node.macroname == 'label':
-                                            label_name = sub_node.nodeargs[0].nodelist[0].chars
-                                            if prev_subsubsection and use_subsubsection:
-                                                label_section_map[label_name] = prev_subsubsection
-                                            elif prev_subsection and use_subsection:
-                                                label_section_map[label_name] = prev_subsection
-                                            elif prev_section:
-                                                label_section_map[label_name] = prev_section
-                        if node.isNodeType(LatexMacroNode):
-                            if node.macroname == 'section':
-                                prev_section = node.nodeargs[0].nodelist[0].chars
-                                prev_subsection    = None
-                                prev_subsubsection = None
-                            if node.macroname == 'subsection':
-                                prev_subsection    = node.nodeargs[0].nodelist[0].chars
-                                prev_subsubsection = None
-                            if node.macroname == 'subsubsection':
-                                prev_subsubsection = node.nodeargs[0].nodelist[0].chars
-                            if node.macroname == 'label':
-                                label_name = node.nodeargs[0].nodelist[0].chars
-                                if prev_subsubsection and use_subsubsection:
-                                    label_section_map[label_name] = prev_subsubsection
-                                elif prev_subsection and use_subsection:
-                                    label_section_map[label_name] = prev_subsection
-                                elif prev_section:
-                                    label_section_map[label_name] = prev_section
-        return label_section_map
-    
-    def add_edges(self, label_section_map, use_subsubsection=False, use_subsection=True):
-        '''
-        Traverse the LatexWalker tree and find all section, subsection, subsubsection, label, and reference elements.
-        When a reference is found, the reference is added as an edge in the graph.
-
-        The label_section_map maps label names to the section, subsection, or subsubsection they refer to.
-        That way, a reference can be resolved to the section, subsection, or subsubsection it refers to.
+    def _scan_latex_nodes(self, use_subsubsection=False, use_subsection=True):
+        '''
+        Traverse the LatexWalker tree once and find all section, subsection, subsubsection, label, and reference elements.
+        When a label is found, it is mapped to the preceding section, subsection, or subsubsection. When a reference is found,
+        it is recorded along with the section it appears in.
 
         If use_subsubsection is True, then the graph will contain edges between subsubsections. Otherwise,
         when referring to a subsubsection, the edge will point to the subsection it belongs to.
+
+        Return the map from label names to sections and the list of (label name, section) pairs of the references.
         '''
         s = self.soup
         (nodelist, pos, len_) = s.get_latex_nodes(pos=0)
 
+        # A LaTeX file has a single document environment, outside of which no section can be found.
+        document = next((node for node in nodelist
+                         if isinstance(node, LatexEnvironmentNode) and node.environmentname == 'document'), None)
+        if document is None:
+            return {}, []
+        return self._scan_document_children(document.nodelist, use_subsubsection, use_subsection)
+
+    def _scan_document_children(self, nodelist, use_subsubsection=False, use_subsection=True):
+        '''
+        Find the section, subsection, subsubsection, label, and reference elements among the children of the
+        document environment, given as a list of LatexWalker nodes.
+
+        Return the map from label names to sections and the list of (label name, section) pairs of the references.
+        '''
         # Keep track of the previous section, subsection, and subsubsection
         # such that the label can refer to the immediately preceding section.
         prev_section        = None
         prev_subsection     = None
         prev_subsubsection  = None
 
-        for node in nodelist:
-            if node.isNodeType(LatexEnvironmentNode):
-                if node.environmentname == 'document':
-                    nodelist = node.nodelist
-                    for node in nodelist:
-                        if node.isNodeType(LatexMacroNode):
-                            if node.macroname == 'section':
-                                prev_section = node.nodeargs[0].nodelist[0].chars
-                                prev_subsection    = None
-                                prev_subsubsection = None
-                            if node.macroname == 'subsection' and use_subsection:
-                                prev_subsection    = node.nodeargs[0].nodelist[0].chars
-                                prev_subsubsection = None
-                            if node.macroname == 'subsubsection' and use_subsubsection:
-                                prev_subsubsection = node.nodeargs[0].nodelist[0].chars
-                            if node.macroname == 'Cref' or node.macroname == 'cref'\
-                                or node.macroname == 'ref' or node.macroname == 'eqref'\
-                                or node.macroname == 'autoref' or node.macroname == 'nameref':
-                                label_name = node.nodeargs[0].nodelist[0].chars
-                                if label_name in label_section_map:
-                                    if prev_subsubsection:
-                                        if prev_subsubsection != label_section_map[label_name]:
-                                            self.graph.add_edge(label_section_map[label_name], prev_subsubsection)
-                                    elif prev_subsection:
-                                        if prev_subsection != label_section_map[label_name]:
-                                            self.graph.add_edge(label_section_map[label_name], prev_subsection)
-                                    elif prev_section:
-                                        if prev_section != label_section_map[label_name]:
-                                            self.graph.add_edge(label_section_map[label_name], prev_section)
+        # Maps label names to the section, subsection, or subsubsection they refer to.
+        # That ways, a reference can be resolved to the section, subsection, or subsubsection it refers to.
+        label_section_map = {}
+
+        # References found during the traversal, as (label name, section containing the reference) pairs.
+        # They can only be resolved after the traversal, once all labels are known.
+        pending_refs = []
+
+        # Local aliases, looked up faster than globals and attributes in the loop below.
+        EnvNode = LatexEnvironmentNode
+        MacNode = LatexMacroNode
+        append_ref = pending_refs.append
+        # Section and label names are interned, as in _scan_source.
+        intern = sys.intern
+
+        # Traverse the body of the document.
+        for child in nodelist:
+            if isinstance(child, MacNode):
+                macroname = child.macroname
+                if macroname == 'section':
+                    prev_section = intern(child.nodeargs[0].nodelist[0].chars)
+                    prev_subsection    = None
+                    prev_subsubsection = None
+                elif macroname == 'subsection':
+                    prev_subsection    = intern(child.nodeargs[0].nodelist[0].chars)
+                    prev_subsubsection = None
+                elif macroname == 'subsubsection':
+                    prev_subsubsection = intern(child.nodeargs[0].nodelist[0].chars)
+                elif macroname == 'label':
+                    label_name = intern(child.nodeargs[0].nodelist[0].chars)
+                    if prev_subsubsection and use_subsubsection:
+                        label_section_map[label_name] = prev_subsubsection
+                    elif prev_subsection and use_subsection:
+                        label_section_map[label_name] = prev_subsection
+                    elif prev_section:
+                        label_section_map[label_name] = prev_section
+                elif macroname in _REF_MACROS:
+                    label_name = intern(child.nodeargs[0].nodelist[0].chars)
+                    if prev_subsubsection and use_subsubsection:
+                        append_ref((label_name, prev_subsubsection))
+                    elif prev_subsection and use_subsection:
+                        append_ref((label_name, prev_subsection))
+                    elif prev_section:
+                        append_ref((label_name, prev_section))
+            elif isinstance(child, EnvNode) and child.environmentname in _ENV_EQUATION:
+                for sub_node in child.nodelist:
+                    if isinstance(sub_node, MacNode) and sub_node.macroname == 'label':
+                        label_name = intern(sub_node.nodeargs[0].nodelist[0].chars)
+                        if prev_subsubsection and use_subsubsection:
+                            label_section_map[label_name] = prev_subsubsection
+                        elif prev_subsection and use_subsection:
+                            label_section_map[label_name] = prev_subsection
+                        elif prev_section:
+                            label_section_map[label_name] = prev_section
+        return label_section_map, pending_refs
 
 if __name__ == '__main__':
     parser = LatexSectionsGraph('example.tex', use_subsubsection=True, use_subsection=True, node_threshold=1)
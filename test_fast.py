@@ -0,0 +1,74 @@
+from latexSectionsGraph import *
+from pathlib import Path
+import tempfile
+
+# Checks that scanning the LaTeX source (fast=True) yields the same graph as parsing it with LatexWalker on documents
+# where both are expected to agree, and that the documented differences between them are kept.
+
+def edges(file_path, fast, use_subsubsection=True, use_subsection=True):
+    parser = LatexSectionsGraph(file_path, use_subsubsection=use_subsubsection, use_subsection=use_subsection,
+                                node_threshold=1, fast=fast)
+    return sorted(parser.graph.edges())
+
+def check_document(body, expected):
+    '''
+    Write body in the document environment of a temporary .tex file, and check that both the parser
+    and the scan produce the expected edges.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = Path(directory) / 'document.tex'
+        file_path.write_text('\\documentclass{article}\n\\begin{document}\n' + body + '\n\\end{document}\n', encoding='utf-8')
+        assert edges(file_path, fast=False) == expected
+        assert edges(file_path, fast=True) == expected
+
+def test_example():
+    for use_subsubsection in (True, False):
+        for use_subsection in (True, False):
+            assert edges('example.tex', False, use_subsubsection, use_subsection)\
+                == edges('example.tex', True, use_subsubsection, use_subsection)
+
+def test_starred_section():
+    check_document('\\section{A}\\section*{Intro}\\label{a}\\section{B}\\ref{a}', [('Intro', 'B')])
+
+def test_starred_section_with_space():
+    check_document('\\section{A}\\section *{Intro}\\label{a}\\section{B}\\ref{a}', [('Intro', 'B')])
+
+def test_section_short_title():
+    check_document('\\section{A}\\label{a}\\section[Short]{C}\\ref{a}', [('A', 'C')])
+
+def test_comment_after_line_break():
+    check_document('\\section{A}\\label{a}\\section{B}\nline \\\\% \\ref{a}\n', [])
+
+def test_ref_after_line_break():
+    check_document('\\section{A}\\label{a}\\section{B}\nx\\\\ref{a}\n\\section{C}\ny\\\\\\ref{a}\n', [('A', 'C')])
+
+def test_escaped_percent():
+    check_document('\\section{A}\\label{a}\\section{B}\n50\\% \\ref{a}\n', [('A', 'B')])
+
+def test_verbatim():
+    check_document('\\section{A}\\label{a}\\section{B}\n\\begin{verbatim}\\ref{a}\\end{verbatim}\n', [])
+    check_document('\\section{A}\\label{a}\\section{B}\n\\verb|\\ref{a}|\n', [])
+    check_document('\\section{A}\\label{a}\\section{B}\n\\begin{lstlisting}\\section{X}\\ref{a}\\end{lstlisting}\n\\ref{a}\n',
+                   [('A', 'B')])
+    check_document('\\section{A}\\label{a}\\section{B}\n\\begin{Verbatim}\\section{X}\\ref{a}\\end{Verbatim}\n\\ref{a}\n',
+                   [('A', 'B')])
+
+def test_nested_reference():
+    # Only the scan finds references nested in groups or macro arguments.
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = Path(directory) / 'document.tex'
+        file_path.write_text('\\documentclass{article}\n\\begin{document}\n'
+                             '\\section{A}\\label{a}\\section{B}\\textbf{\\ref{a}}\n\\end{document}\n', encoding='utf-8')
+        assert edges(file_path, fast=False) == []
+        assert edges(file_path, fast=True) == [('A', 'B')]
+
+if __name__ == '__main__':
+    test_example()
+    test_starred_section()
+    test_starred_section_with_space()
+    test_section_short_title()
+    test_comment_after_line_break()
+    test_ref_after_line_break()
+    test_escaped_percent()
+    test_verbatim()
+    test_nested_reference()